@@ -0,0 +1,77 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+import hmac
+import os
+
+from ..services.profiling_service import LoopLagMonitor, RequestProfiler
+
+router = APIRouter()
+
+# 管理员令牌，未配置时禁用所有管理端点
+ADMIN_TOKEN = os.getenv("FLUX_ADMIN_TOKEN", "")
+
+# 初始化性能分析工具
+loop_lag_monitor = LoopLagMonitor(
+    threshold=float(os.getenv("FLUX_LOOP_LAG_THRESHOLD_MS", "100")) / 1000
+)
+request_profiler = RequestProfiler(
+    profile_dir=os.getenv("FLUX_PROFILE_DIR", "/tmp/flux_profiles"),
+    sample_rate=float(os.getenv("FLUX_PROFILE_SAMPLE_RATE", "0"))
+)
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """检查管理员令牌"""
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """管理端点的鉴权依赖"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="需要管理员权限")
+
+@router.get("/loop-lag", dependencies=[Depends(require_admin)])
+async def get_loop_lag():
+    """
+    获取事件循环延迟监控状态和最近的卡顿调用栈
+    """
+    return loop_lag_monitor.get_stats()
+
+@router.post("/loop-lag/start", dependencies=[Depends(require_admin)])
+async def start_loop_lag_monitor(threshold_ms: Optional[float] = None):
+    """
+    启动事件循环延迟监控
+    """
+    if threshold_ms is not None:
+        loop_lag_monitor.threshold = threshold_ms / 1000
+    loop_lag_monitor.start()
+    return loop_lag_monitor.get_stats()
+
+@router.post("/loop-lag/stop", dependencies=[Depends(require_admin)])
+async def stop_loop_lag_monitor():
+    """
+    停止事件循环延迟监控
+    """
+    loop_lag_monitor.stop()
+    return {"running": False}
+
+@router.get("/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """
+    列出已保存的请求性能分析结果
+    """
+    return {
+        "sample_rate": request_profiler.sample_rate,
+        "profiles": request_profiler.list_profiles()
+    }
+
+@router.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str):
+    """
+    下载 pstats 格式的性能分析文件
+    """
+    path = request_profiler.get_profile_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="分析结果不存在")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
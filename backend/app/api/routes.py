@@ -1,14 +1,21 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import asyncio
+import os
+import random
 import uuid
 import aiohttp
 from datetime import datetime
+from urllib.parse import quote
 
 from ..services.comfyui_service import ComfyUIService
+from ..services.export_service import ExportService
+from ..services.history_service import HistoryService
 from ..services.image_service import ImageService
+from ..services.job_scheduler import JobScheduler
+from ..services.workflow_validator import WorkflowValidationError
 
 router = APIRouter()
 
@@ -22,6 +29,20 @@ class ImageGenerationRequest(BaseModel):
     seed: Optional[int] = None
     sampler_name: Optional[str] = "euler"
     scheduler: Optional[str] = "simple"
+    # 草稿模式：先以低分辨率、少步数和相同种子生成预览，再执行完整质量的生成
+    draft: Optional[bool] = False
+    # 草稿完成后是否自动排队完整生成，为 False 时需调用 promote 接口
+    auto_full: Optional[bool] = True
+
+# 不影响生成结果的请求字段，不参与历史缓存的参数匹配
+NON_RENDER_FIELDS = {"draft", "auto_full"}
+
+# 草稿参数：分辨率缩放比例和步数比例
+DRAFT_SCALE = float(os.getenv("FLUX_DRAFT_SCALE", "0.5"))
+DRAFT_STEPS_RATIO = float(os.getenv("FLUX_DRAFT_STEPS_RATIO", "0.25"))
+DRAFT_PRIORITY = 1
+# 草稿任务的整体进度中，草稿阶段占前 20%，完整生成占其余部分
+DRAFT_PROGRESS_SHARE = 0.2
 
 # 响应模型
 class ImageGenerationResponse(BaseModel):
@@ -35,37 +56,103 @@ class TaskStatusResponse(BaseModel):
     progress: Optional[float] = None
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    eta_seconds: Optional[float] = None
+    queue_position: Optional[int] = None
+    phase: Optional[str] = None
+    draft_result: Optional[Dict[str, Any]] = None
 
 # 初始化服务
 comfyui_service = ComfyUIService()
-image_service = ImageService()
+image_service = ImageService(local_resolver=comfyui_service.resolve_local_path)
+history_service = HistoryService()
+export_service = ExportService(comfyui_service, image_service)
+job_scheduler = JobScheduler(
+    mode=os.getenv("FLUX_SCHEDULER_MODE", "fifo"),
+    max_concurrent=int(os.getenv("FLUX_MAX_CONCURRENT_JOBS", "1"))
+)
 
 # 存储任务状态
 tasks_status = {}
 
+# 草稿任务的完整生成协程，用于跳过尚未开始的完整生成
+full_pass_tasks: Dict[str, asyncio.Task] = {}
+
 @router.post("/generate", response_model=ImageGenerationResponse)
-async def generate_image(request: ImageGenerationRequest, background_tasks: BackgroundTasks):
+async def generate_image(request: ImageGenerationRequest, background_tasks: BackgroundTasks, http_request: Request):
     """
     生成图像的主要端点
     """
     try:
+        # 使用缓存的节点定义在本地校验参数，无效请求不进入队列
+        comfyui_service.validate_parameters(
+            prompt=request.prompt,
+            width=request.width,
+            height=request.height,
+            steps=request.steps,
+            cfg=request.cfg,
+            seed=request.seed,
+            sampler_name=request.sampler_name,
+            scheduler=request.scheduler
+        )
+        
         # 生成唯一任务ID
         task_id = str(uuid.uuid4())
         
+        # 指定了种子时，参数完全相同的历史结果可直接复用
+        if request.seed is not None and request.seed >= 0:
+            cached = await asyncio.to_thread(
+                history_service.find_cached, request.model_dump(exclude=NON_RENDER_FIELDS)
+            )
+            # 图像文件已被清理时不复用，走正常生成
+            if cached and await comfyui_service.images_available(cached["images"]):
+                tasks_status[task_id] = {
+                    "status": "completed",
+                    "progress": 1.0,
+                    "created_at": datetime.now(),
+                    "result": {
+                        "success": True,
+                        "images": cached["images"],
+                        "workflow_id": cached["workflow_id"],
+                        "seed": cached["seed"],
+                        "prompt": cached["prompt"],
+                        "cached": True
+                    },
+                    "error": None
+                }
+                return ImageGenerationResponse(
+                    task_id=task_id,
+                    status="completed",
+                    message="命中历史结果缓存"
+                )
+        
+        # 草稿和完整生成使用相同的种子
+        if request.draft and (request.seed is None or request.seed < 0):
+            request.seed = random.randint(0, 2**32 - 1)
+        
         # 初始化任务状态
         tasks_status[task_id] = {
             "status": "pending",
             "progress": 0.0,
             "created_at": datetime.now(),
             "result": None,
-            "error": None
+            "error": None,
+            "phase": "draft" if request.draft else "full",
+            "draft": bool(request.draft),
+            "draft_result": None,
+            # 草稿阶段的 ETA 需要加上随后完整生成的预测耗时
+            "full_estimate": (
+                comfyui_service.predict_duration(request.width, request.height, request.steps)
+                if request.draft and request.auto_full else None
+            )
         }
         
-        # 在后台执行图像生成
+        # 在后台执行图像生成，按客户端地址区分公平调度的来源
+        flow = http_request.client.host if http_request.client else "default"
         background_tasks.add_task(
             process_image_generation,
             task_id,
-            request
+            request,
+            flow
         )
         
         return ImageGenerationResponse(
@@ -74,6 +161,8 @@ async def generate_image(request: ImageGenerationRequest, background_tasks: Back
             message="图像生成任务已启动"
         )
         
+    except WorkflowValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"启动图像生成失败: {str(e)}")
 
@@ -91,9 +180,53 @@ async def get_task_status(task_id: str):
         status=task["status"],
         progress=task["progress"],
         result=task["result"],
-        error=task["error"]
+        error=task["error"],
+        eta_seconds=estimate_task_remaining(task_id),
+        queue_position=job_scheduler.get_queue_position(task_id),
+        phase=task.get("phase"),
+        draft_result=task.get("draft_result")
     )
 
+@router.post("/task/{task_id}/promote", response_model=TaskStatusResponse)
+async def promote_draft(task_id: str, http_request: Request):
+    """
+    将已完成草稿的任务提升为完整质量生成
+    """
+    task = tasks_status.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task["status"] != "draft_completed":
+        raise HTTPException(status_code=409, detail="任务没有待提升的草稿")
+    
+    flow = http_request.client.host if http_request.client else "default"
+    start_full_pass(task_id, task["request"], flow)
+    return await get_task_status(task_id)
+
+@router.post("/task/{task_id}/skip", response_model=TaskStatusResponse)
+async def skip_full_pass(task_id: str):
+    """
+    跳过草稿任务的完整生成，以草稿作为最终结果
+    """
+    task = tasks_status.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if not task.get("draft_result"):
+        raise HTTPException(status_code=409, detail="任务没有可用的草稿")
+    
+    if task["status"] == "pending" and task_id in full_pass_tasks:
+        # 完整生成仍在排队，取消后不会提交到 ComfyUI
+        full_pass_tasks.pop(task_id).cancel()
+    elif task["status"] != "draft_completed":
+        raise HTTPException(status_code=409, detail="完整生成已开始或已结束，无法跳过")
+    
+    task["status"] = "completed"
+    task["progress"] = 1.0
+    task["result"] = task["draft_result"]
+    task["phase"] = "draft"
+    # 草稿作为最终结果，按草稿实际使用的分辨率和步数写入生成历史
+    await record_history(task_id, task["draft_request"], task["draft_result"])
+    return await get_task_status(task_id)
+
 @router.get("/tasks")
 async def list_tasks():
     """
@@ -105,33 +238,212 @@ async def list_tasks():
                 "task_id": task_id,
                 "status": task_info["status"],
                 "progress": task_info["progress"],
-                "created_at": task_info["created_at"].isoformat()
+                "created_at": task_info["created_at"].isoformat(),
+                "eta_seconds": estimate_task_remaining(task_id)
             }
             for task_id, task_info in tasks_status.items()
         ]
     }
 
-async def process_image_generation(task_id: str, request: ImageGenerationRequest):
+@router.get("/object-info")
+async def get_object_info_status(refresh: bool = False):
+    """
+    获取缓存的 ComfyUI 节点定义状态，refresh=true 时重新获取
+    """
+    if refresh:
+        await comfyui_service.refresh_object_info()
+    schema = comfyui_service.object_info_schema
+    return {
+        "cached": schema is not None,
+        "node_count": len(schema.nodes) if schema else 0,
+        "fetched_at": schema.fetched_at if schema else None,
+        "samplers": sorted(schema.get_choices("KSampler", "sampler_name") or []) if schema else [],
+        "schedulers": sorted(schema.get_choices("KSampler", "scheduler") or []) if schema else []
+    }
+
+@router.get("/scheduler")
+async def get_scheduler_status():
+    """
+    获取调度器状态和耗时预测模型
+    """
+    return {
+        "scheduler": job_scheduler.get_stats(),
+        "predictor": comfyui_service.duration_predictor.get_stats()
+    }
+
+# 历史查询是同步的 SQLite 调用，定义为普通函数由 FastAPI 放到线程池执行，不阻塞事件循环
+@router.get("/history")
+def list_history(limit: int = 50, cursor: Optional[int] = None):
+    """
+    分页列出生成历史，使用上一页返回的 next_cursor 获取下一页
+    """
+    return history_service.list_history(limit=limit, cursor=cursor)
+
+@router.get("/history/search")
+def search_history(q: str, limit: int = 50, cursor: Optional[int] = None):
+    """
+    按提示词全文检索生成历史
+    """
+    return history_service.search_history(q, limit=limit, cursor=cursor)
+
+@router.get("/history/{task_id}")
+def get_history_item(task_id: str):
+    """
+    获取单条生成历史
+    """
+    item = history_service.get_by_task_id(task_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="历史记录不存在")
+    return item
+
+async def iter_export_records(task_ids: Optional[List[str]], q: Optional[str], limit: int):
+    """
+    按任务 ID 或历史检索条件逐条产出导出记录，历史按游标分页惰性读取，
+    每次查询都放到线程池执行
+    """
+    if task_ids:
+        for task_id in task_ids[:limit]:
+            task = tasks_status.get(task_id)
+            if task and task["result"]:
+                result = task["result"]
+                yield {
+                    "task_id": task_id,
+                    "prompt": result.get("prompt"),
+                    "seed": result.get("seed"),
+                    "params": None,
+                    "images": result.get("images", [])
+                }
+                continue
+            
+            item = await asyncio.to_thread(history_service.get_by_task_id, task_id)
+            if item:
+                yield item
+        return
+    
+    cursor = None
+    remaining = limit
+    while remaining > 0:
+        page_size = min(remaining, 200)
+        if q:
+            page = await asyncio.to_thread(history_service.search_history, q, page_size, cursor)
+        else:
+            page = await asyncio.to_thread(history_service.list_history, page_size, cursor)
+        
+        for item in page["items"]:
+            yield item
+        remaining -= len(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+@router.get("/export")
+async def export_images(
+    task_ids: Optional[List[str]] = Query(None),
+    q: Optional[str] = None,
+    limit: int = 1000,
+    format: str = "zip",
+    manifest: bool = True
+):
+    """
+    批量导出图像为 zip/tar 归档并流式返回
+
+    指定 task_ids 时导出这些任务的图像，否则导出匹配 q 的生成历史（q 为空时为最近的历史）
+    """
+    if format not in ("zip", "tar"):
+        raise HTTPException(status_code=400, detail="format 仅支持 zip 或 tar")
+    
+    limit = max(1, min(limit, 100000))
+    stream, media_type = export_service.stream_archive(
+        iter_export_records(task_ids, q, limit),
+        archive_format=format,
+        include_manifest=manifest
+    )
+    filename = f"flux_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+def make_draft_request(request: ImageGenerationRequest) -> ImageGenerationRequest:
+    """
+    生成草稿参数：缩小分辨率（对齐到 16 像素）并减少步数，其余参数保持不变
+    """
+    def scale(size: int) -> int:
+        return max(256, int(size * DRAFT_SCALE) // 16 * 16)
+    
+    return request.model_copy(update={
+        "width": min(request.width, scale(request.width)),
+        "height": min(request.height, scale(request.height)),
+        "steps": min(request.steps, max(4, int(request.steps * DRAFT_STEPS_RATIO))),
+        "draft": False
+    })
+
+async def process_image_generation(task_id: str, request: ImageGenerationRequest, flow: str = "default"):
     """
     处理图像生成的后台任务
     """
+    if not request.draft:
+        await run_full_pass(task_id, request, flow)
+        return
+    
     try:
-        # 更新状态为处理中
-        tasks_status[task_id]["status"] = "processing"
-        tasks_status[task_id]["progress"] = 0.1
-        
-        # 调用 ComfyUI 服务生成图像
-        result = await comfyui_service.generate_image(
-            prompt=request.prompt,
-            width=request.width,
-            height=request.height,
-            steps=request.steps,
-            cfg=request.cfg,
-            seed=request.seed,
-            sampler_name=request.sampler_name,
-            scheduler=request.scheduler,
-            task_id=task_id,
-            progress_callback=lambda progress: update_task_progress(task_id, progress)
+        # 草稿优先调度，尽快返回预览
+        draft_request = make_draft_request(request)
+        estimate = comfyui_service.predict_duration(draft_request.width, draft_request.height, draft_request.steps)
+        draft_result = await job_scheduler.run(
+            task_id,
+            lambda: run_image_generation(task_id, draft_request),
+            estimate=estimate,
+            flow=flow,
+            priority=DRAFT_PRIORITY
+        )
+    except Exception as e:
+        tasks_status[task_id]["status"] = "failed"
+        tasks_status[task_id]["error"] = str(e)
+        print(f"草稿生成失败 (任务 {task_id}): {str(e)}")
+        return
+    
+    tasks_status[task_id]["draft_result"] = draft_result
+    tasks_status[task_id]["draft_request"] = draft_request
+    
+    # 草稿本身失败时不再执行完整生成
+    if not draft_result.get("success"):
+        tasks_status[task_id]["status"] = "completed"
+        tasks_status[task_id]["progress"] = 1.0
+        tasks_status[task_id]["result"] = draft_result
+        return
+    
+    if request.auto_full:
+        start_full_pass(task_id, request, flow)
+    else:
+        tasks_status[task_id]["status"] = "draft_completed"
+        tasks_status[task_id]["progress"] = DRAFT_PROGRESS_SHARE
+        tasks_status[task_id]["request"] = request
+
+def start_full_pass(task_id: str, request: ImageGenerationRequest, flow: str):
+    """
+    草稿完成后将完整生成加入调度队列
+    """
+    tasks_status[task_id]["status"] = "pending"
+    tasks_status[task_id]["progress"] = DRAFT_PROGRESS_SHARE
+    tasks_status[task_id]["phase"] = "full"
+    task = asyncio.get_running_loop().create_task(run_full_pass(task_id, request, flow))
+    full_pass_tasks[task_id] = task
+    task.add_done_callback(lambda _: full_pass_tasks.pop(task_id, None))
+
+async def run_full_pass(task_id: str, request: ImageGenerationRequest, flow: str = "default"):
+    """
+    以完整质量参数排队并执行生成
+    """
+    try:
+        # 按预测耗时排队，等待执行槽位
+        estimate = comfyui_service.predict_duration(request.width, request.height, request.steps)
+        result = await job_scheduler.run(
+            task_id,
+            lambda: run_image_generation(task_id, request),
+            estimate=estimate,
+            flow=flow
         )
         
         # 更新任务状态为完成
@@ -139,28 +451,92 @@ async def process_image_generation(task_id: str, request: ImageGenerationRequest
         tasks_status[task_id]["progress"] = 1.0
         tasks_status[task_id]["result"] = result
         
+        await record_history(task_id, request, result)
+        
     except Exception as e:
         # 更新任务状态为失败
         tasks_status[task_id]["status"] = "failed"
         tasks_status[task_id]["error"] = str(e)
         print(f"图像生成失败 (任务 {task_id}): {str(e)}")
 
+async def record_history(task_id: str, request: ImageGenerationRequest, result: Dict[str, Any]):
+    """
+    写入生成历史索引（失败和模拟结果不记录）
+    """
+    if result.get("success") and not result.get("simulated"):
+        params = request.model_dump(exclude=NON_RENDER_FIELDS)
+        params["seed"] = result.get("seed")
+        await history_service.record(
+            task_id, params, result,
+            created_at=tasks_status[task_id]["created_at"].timestamp()
+        )
+
+async def run_image_generation(task_id: str, request: ImageGenerationRequest) -> Dict[str, Any]:
+    """
+    获得执行槽位后调用 ComfyUI 生成图像
+    """
+    # 更新状态为处理中
+    tasks_status[task_id]["status"] = "processing"
+    update_task_progress(task_id, 0.1)
+    
+    # 调用 ComfyUI 服务生成图像
+    return await comfyui_service.generate_image(
+        prompt=request.prompt,
+        width=request.width,
+        height=request.height,
+        steps=request.steps,
+        cfg=request.cfg,
+        seed=request.seed,
+        sampler_name=request.sampler_name,
+        scheduler=request.scheduler,
+        task_id=task_id,
+        progress_callback=lambda progress: update_task_progress(task_id, progress)
+    )
+
 def update_task_progress(task_id: str, progress: float):
-    """更新任务进度"""
-    if task_id in tasks_status:
-        tasks_status[task_id]["progress"] = progress
+    """更新任务进度，草稿任务按阶段映射到整体进度"""
+    task = tasks_status.get(task_id)
+    if not task:
+        return
+    if task.get("draft"):
+        if task["phase"] == "draft":
+            progress = progress * DRAFT_PROGRESS_SHARE
+        else:
+            progress = DRAFT_PROGRESS_SHARE + progress * (1 - DRAFT_PROGRESS_SHARE)
+    task["progress"] = progress
+
+def estimate_task_remaining(task_id: str) -> Optional[float]:
+    """估算任务剩余时间，草稿阶段包含随后完整生成的预测耗时"""
+    eta = job_scheduler.estimate_remaining(task_id)
+    task = tasks_status.get(task_id)
+    if eta is not None and task and task.get("phase") == "draft" and task.get("full_estimate"):
+        eta += task["full_estimate"]
+    return eta
+
+def content_disposition(disposition_type: str, filename: str) -> str:
+    """按 RFC 5987 构造 Content-Disposition，非 ASCII 文件名使用 filename* 编码"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition_type}; filename*=utf-8''{quoted}"
+    return f'{disposition_type}; filename="{filename}"'
 
 @router.get("/image/{filename}")
 async def get_image(filename: str, subfolder: str = "", type: str = "output"):
     """
     代理访问 ComfyUI 生成的图像
     """
+    # ComfyUI 在本机时直接发送输出文件，不经过 HTTP 转发
+    local_path = comfyui_service.resolve_local_path(filename, subfolder, type)
+    if local_path:
+        # 由 FileResponse 按 RFC 5987 编码文件名，支持非 latin-1 字符
+        return FileResponse(local_path, filename=filename, content_disposition_type="inline")
+    
     try:
-        comfyui_url = "http://127.0.0.1:7860"
-        image_url = f"{comfyui_url}/view?filename={filename}&subfolder={subfolder}&type={type}"
+        image_url = f"{comfyui_service.comfyui_url}/view"
+        params = {"filename": filename, "subfolder": subfolder, "type": type}
         
         async with aiohttp.ClientSession() as session:
-            async with session.get(image_url) as response:
+            async with session.get(image_url, params=params) as response:
                 if response.status == 200:
                     content = await response.read()
                     content_type = response.headers.get('content-type', 'image/png')
@@ -168,10 +544,12 @@ async def get_image(filename: str, subfolder: str = "", type: str = "output"):
                     return StreamingResponse(
                         iter([content]),
                         media_type=content_type,
-                        headers={"Content-Disposition": f"inline; filename={filename}"}
+                        headers={"Content-Disposition": content_disposition("inline", filename)}
                     )
                 else:
                     raise HTTPException(status_code=404, detail="Image not found")
                     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching image: {str(e)}")
\ No newline at end of file
@@ -6,8 +6,10 @@ import uvicorn
 import os
 from typing import Optional
 
-from .api.routes import router as api_router
+from .api.routes import router as api_router, comfyui_service
+from .api.admin import router as admin_router, loop_lag_monitor, request_profiler, is_admin_token
 from .services.comfyui_service import ComfyUIService
+from .services.profiling_service import RequestProfilingMiddleware
 
 # 创建 FastAPI 应用实例
 app = FastAPI(
@@ -34,6 +36,20 @@ app.add_middleware(
 
 # 包含 API 路由
 app.include_router(api_router, prefix="/api/v1")
+app.include_router(admin_router, prefix="/api/v1/admin")
+
+# 按请求性能分析：管理员通过 X-Profile 头或 profile 查询参数显式开启，或按采样率随机开启
+app.add_middleware(RequestProfilingMiddleware, profiler=request_profiler, is_admin=is_admin_token)
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    if os.getenv("FLUX_LOOP_MONITOR", "0") == "1":
+        loop_lag_monitor.start()
+
+@app.on_event("startup")
+async def prefetch_object_info():
+    # 后台预取 ComfyUI 节点定义，用于本地校验工作流
+    comfyui_service.ensure_object_info()
 
 # 全局异常处理
 @app.exception_handler(Exception)
@@ -5,7 +5,27 @@ import aiohttp
 import random
 from typing import Dict, Any, Optional, Callable
 import os
+import time
 from datetime import datetime
+from urllib.parse import quote, urlparse
+
+from .duration_predictor import DurationPredictor
+from .workflow_validator import ObjectInfoSchema, WorkflowValidationError
+
+class GenerationError(Exception):
+    """
+    工作流已提交到 ComfyUI 后发生的错误，不再退回模拟生成
+    """
+    pass
+
+class GenerationTimeoutError(GenerationError):
+    """
+    ComfyUI 执行超时，execution_time 为放弃前已执行的时长
+    """
+
+    def __init__(self, message: str, execution_time: float):
+        self.execution_time = execution_time
+        super().__init__(message)
 
 class ComfyUIService:
     """
@@ -15,6 +35,25 @@ class ComfyUIService:
     def __init__(self, comfyui_url: str = "http://127.0.0.1:7860"):
         self.comfyui_url = comfyui_url
         self.workflow_template = None
+        self.duration_predictor = DurationPredictor()
+        # 自适应超时: 预测耗时 × 系数，限制在 [最小值, 最大值] 之间
+        self.timeout_factor = float(os.getenv("FLUX_TIMEOUT_FACTOR", "3.0"))
+        self.min_timeout = float(os.getenv("FLUX_MIN_TIMEOUT", "60"))
+        self.max_timeout = float(os.getenv("FLUX_MAX_TIMEOUT", "1800"))
+        # 观测数据不足时使用的超时下限（原固定超时 5 分钟）
+        self.cold_timeout = float(os.getenv("FLUX_COLD_TIMEOUT", "300"))
+        # 超时的任务按已执行时长 × 该系数记为一次观测，让预测值能够增长
+        self.timeout_observation_factor = 1.5
+        # 返回给前端的图像代理地址
+        self.public_base_url = os.getenv("FLUX_PUBLIC_BASE_URL", "http://localhost:8000").rstrip("/")
+        # ComfyUI 安装目录，与本服务同机部署时直接读取其输出文件
+        self.comfyui_dir = os.getenv("FLUX_COMFYUI_DIR", "")
+        self.local_files_mode = os.getenv("FLUX_LOCAL_FILES", "auto")
+        # 缓存的 /object_info 节点定义，用于本地校验工作流
+        self.object_info_schema: Optional[ObjectInfoSchema] = None
+        self._object_info_attempted_at = 0.0
+        self._object_info_task: Optional[asyncio.Task] = None  # 进行中的后台获取
+        self._connected = False  # 启动预取节点定义成功后置为 True
         self.load_workflow_template()
     
     def load_workflow_template(self):
@@ -151,7 +190,10 @@ class ComfyUIService:
             workflow["31"]["inputs"]["seed"] = seed
             workflow["31"]["inputs"]["steps"] = steps
             workflow["31"]["inputs"]["cfg"] = cfg
-            # sampler_name 和 scheduler 使用工作流默认值
+            if sampler_name:
+                workflow["31"]["inputs"]["sampler_name"] = sampler_name
+            if scheduler:
+                workflow["31"]["inputs"]["scheduler"] = scheduler
         
         # 节点27: 空Latent图像 - 更新图像尺寸
         if "27" in workflow:
@@ -165,6 +207,151 @@ class ComfyUIService:
         
         return workflow
     
+    @property
+    def local_files_enabled(self) -> bool:
+        """
+        是否直接访问 ComfyUI 的本地文件目录
+
+        auto 模式下仅当 ComfyUI 运行在本机时启用，远程后端自动回退到 HTTP
+        """
+        if self.local_files_mode == "off" or not self.comfyui_dir or not os.path.isdir(self.comfyui_dir):
+            return False
+        if self.local_files_mode == "on":
+            return True
+        host = urlparse(self.comfyui_url).hostname
+        return host in ("127.0.0.1", "localhost", "::1")
+    
+    def resolve_local_path(self, filename: str, subfolder: str = "", img_type: str = "output") -> Optional[str]:
+        """
+        将 ComfyUI 的 (filename, subfolder, type) 解析为本地文件路径
+
+        路径必须位于对应类型的目录之内，防止目录穿越；不可用时返回 None
+        """
+        if not self.local_files_enabled or img_type not in ("output", "input", "temp") or not filename:
+            return None
+        
+        base_dir = os.path.realpath(os.path.join(self.comfyui_dir, img_type))
+        path = os.path.realpath(os.path.join(base_dir, subfolder or "", filename))
+        if os.path.commonpath([base_dir, path]) != base_dir:
+            return None
+        return path if os.path.isfile(path) else None
+    
+    async def images_available(self, images: list) -> bool:
+        """
+        检查图像文件是否仍然存在，本地模式直接检查文件，否则向 ComfyUI /view 发送 HEAD 请求
+        """
+        if not images:
+            return False
+        if self.local_files_enabled:
+            return all(
+                self.resolve_local_path(img.get("filename"), img.get("subfolder", ""), img.get("type", "output"))
+                for img in images
+            )
+        try:
+            async with aiohttp.ClientSession() as session:
+                for img in images:
+                    params = {
+                        "filename": img.get("filename", ""),
+                        "subfolder": img.get("subfolder", ""),
+                        "type": img.get("type", "output"),
+                    }
+                    async with session.head(f"{self.comfyui_url}/view", params=params, timeout=5) as response:
+                        if response.status != 200:
+                            return False
+            return True
+        except Exception as e:
+            print(f"检查图像文件时出错: {str(e)}")
+            return False
+    
+    def build_image_url(self, filename: str, subfolder: str = "", img_type: str = "output") -> str:
+        """
+        构建后端图像代理 URL
+        """
+        return (
+            f"{self.public_base_url}/api/v1/image/{quote(filename)}"
+            f"?subfolder={quote(subfolder)}&type={quote(img_type)}"
+        )
+    
+    async def refresh_object_info(self) -> bool:
+        """
+        从 ComfyUI 获取 /object_info 并缓存编译后的节点定义
+        """
+        self._object_info_attempted_at = time.monotonic()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{self.comfyui_url}/object_info", timeout=10) as response:
+                    if response.status != 200:
+                        print(f"获取节点定义失败: HTTP {response.status}")
+                        return False
+                    object_info = await response.json()
+            
+            self.object_info_schema = ObjectInfoSchema(object_info)
+            # 获取成功说明后端已连接，避免首次状态检查再次重复获取
+            self._connected = True
+            print(f"已缓存 {len(self.object_info_schema.nodes)} 个节点定义")
+            return True
+        except Exception as e:
+            print(f"获取节点定义时出错: {str(e)}")
+            return False
+    
+    def ensure_object_info(self, retry_interval: float = 30.0):
+        """
+        尚未缓存节点定义时在后台获取，不阻塞当前请求；后端不可用时按间隔重试
+        """
+        if self.object_info_schema is None and time.monotonic() - self._object_info_attempted_at >= retry_interval:
+            self._schedule_object_info_refresh()
+    
+    def _schedule_object_info_refresh(self):
+        """
+        在后台获取节点定义，保留任务引用；已有获取在进行时不重复发起
+        """
+        if self._object_info_task is not None and not self._object_info_task.done():
+            return
+        self._object_info_attempted_at = time.monotonic()
+        self._object_info_task = asyncio.get_running_loop().create_task(self.refresh_object_info())
+    
+    def validate_workflow(self, workflow: Dict[str, Any]):
+        """
+        使用缓存的节点定义校验工作流，未缓存时跳过
+        """
+        if self.object_info_schema is None:
+            return
+        errors = self.object_info_schema.validate(workflow)
+        if errors:
+            raise WorkflowValidationError(errors)
+    
+    def validate_parameters(self, prompt: str, width: int = 1024, height: int = 1024,
+                            steps: int = 20, cfg: float = 1.0, seed: Optional[int] = None,
+                            sampler_name: str = "euler", scheduler: str = "simple"):
+        """
+        按生成参数准备工作流并在本地校验，供提交任务前快速失败
+        """
+        self.ensure_object_info()
+        workflow = self.prepare_workflow(
+            prompt=prompt, width=width, height=height,
+            steps=steps, cfg=cfg, seed=seed,
+            sampler_name=sampler_name, scheduler=scheduler
+        )
+        self.validate_workflow(workflow)
+    
+    def predict_duration(self, width: int = 1024, height: int = 1024, steps: int = 20) -> float:
+        """
+        预测任务在当前后端上的执行耗时（秒）
+        """
+        return self.duration_predictor.predict(self.comfyui_url, width, height, steps)
+    
+    def get_timeout(self, expected_duration: float) -> float:
+        """
+        根据预测耗时计算等待超时
+
+        后端的真实观测不足 min_samples 次时预测还不可靠，超时不低于 cold_timeout。
+        """
+        timeout = min(max(expected_duration * self.timeout_factor, self.min_timeout), self.max_timeout)
+        predictor = self.duration_predictor
+        if predictor.sample_count(self.comfyui_url) < predictor.min_samples:
+            timeout = max(timeout, self.cold_timeout)
+        return timeout
+    
     async def generate_image(self, prompt: str, width: int = 1024, height: int = 1024,
                            steps: int = 20, cfg: float = 1.0, seed: Optional[int] = None,
                            sampler_name: str = "euler", scheduler: str = "simple",
@@ -173,18 +360,40 @@ class ComfyUIService:
         生成图像的主要方法
         """
         try:
+            # 提前确定种子，便于在结果中记录
+            if seed is None or seed < 0:
+                seed = random.randint(0, 2**32 - 1)
+            
             # 准备工作流
             workflow = self.prepare_workflow(
                 prompt=prompt, width=width, height=height,
                 steps=steps, cfg=cfg, seed=seed,
                 sampler_name=sampler_name, scheduler=scheduler
             )
+            self.validate_workflow(workflow)
             
             if progress_callback:
                 progress_callback(0.2)
             
+            expected_duration = self.predict_duration(width, height, steps)
+            
             # 发送工作流到 ComfyUI
-            result = await self._execute_workflow(workflow, progress_callback)
+            start_time = time.monotonic()
+            try:
+                result = await self._execute_workflow(workflow, progress_callback, expected_duration)
+            except GenerationTimeoutError as e:
+                # 实际耗时至少为已执行时长，放大后记录，避免预测偏小导致持续超时
+                self.duration_predictor.observe(
+                    self.comfyui_url, width, height, steps,
+                    e.execution_time * self.timeout_observation_factor
+                )
+                raise
+            total_time = time.monotonic() - start_time
+            
+            # 只用真实执行的耗时（不含 ComfyUI 队列等待）更新预测模型
+            execution_time = result.get("execution_time")
+            if execution_time and not result.get("simulated"):
+                self.duration_predictor.observe(self.comfyui_url, width, height, steps, execution_time)
             
             if progress_callback:
                 progress_callback(1.0)
@@ -194,9 +403,21 @@ class ComfyUIService:
                 "images": result.get("images", []),
                 "workflow_id": result.get("workflow_id"),
                 "seed": seed,
-                "prompt": prompt
+                "prompt": prompt,
+                "execution_time": execution_time,
+                "total_time": total_time,
+                "predicted_time": expected_duration,
+                "simulated": result.get("simulated", False)
             }
             
+        except WorkflowValidationError as e:
+            print(f"图像生成失败: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "validation_errors": e.errors,
+                "prompt": prompt
+            }
         except Exception as e:
             print(f"图像生成失败: {str(e)}")
             return {
@@ -205,7 +426,8 @@ class ComfyUIService:
                 "prompt": prompt
             }
     
-    async def _execute_workflow(self, workflow: Dict[str, Any], progress_callback: Optional[Callable] = None) -> Dict[str, Any]:
+    async def _execute_workflow(self, workflow: Dict[str, Any], progress_callback: Optional[Callable] = None,
+                                expected_duration: Optional[float] = None) -> Dict[str, Any]:
         """
         执行工作流
         """
@@ -229,6 +451,16 @@ class ComfyUIService:
                     print(f"ComfyUI 响应状态: {response.status}")
                     print(f"ComfyUI 响应内容: {response_text}")
                     
+                    # ComfyUI 拒绝工作流时直接报错，不退回模拟生成
+                    if response.status == 400:
+                        try:
+                            error_data = json.loads(response_text)
+                        except ValueError:
+                            error_data = {}
+                        raise WorkflowValidationError(
+                            self._format_node_errors(error_data) or [f"ComfyUI 拒绝工作流: {response_text}"]
+                        )
+                    
                     if response.status != 200:
                         raise Exception(f"提交工作流失败: {response.status}, 响应: {response_text}")
                     
@@ -242,16 +474,31 @@ class ComfyUIService:
                         progress_callback(0.3)
                     
                     # 等待生成完成
-                    return await self._wait_for_completion(prompt_id, progress_callback)
+                    return await self._wait_for_completion(prompt_id, progress_callback, expected_duration)
                     
+        except (WorkflowValidationError, GenerationError):
+            raise
         except Exception as e:
             print(f"执行工作流时出错: {str(e)}")
             # 如果出错，返回模拟结果
             return await self._simulate_generation(progress_callback)
     
+    @staticmethod
+    def _format_node_errors(error_data: Dict[str, Any]) -> list:
+        """
+        将 ComfyUI 返回的 node_errors 转换为错误信息列表
+        """
+        errors = []
+        for node_id, node_error in (error_data.get("node_errors") or {}).items():
+            class_type = node_error.get("class_type", "")
+            for error in node_error.get("errors", []):
+                details = error.get("details") or error.get("message", "")
+                errors.append(f"节点 {node_id} ({class_type}): {details}")
+        return errors
+    
     async def _check_comfyui_status(self) -> bool:
         """
-        检查 ComfyUI 服务状态
+        检查 ComfyUI 服务状态，重新连接后刷新节点定义
         """
         try:
             async with aiohttp.ClientSession() as session:
@@ -259,59 +506,110 @@ class ComfyUIService:
                     f"{self.comfyui_url}/system_stats",
                     timeout=5
                 ) as response:
-                    return response.status == 200
+                    connected = response.status == 200
         except:
-            return False
+            connected = False
+        
+        # 重新连接后在后台刷新节点定义，不阻塞当前生成任务
+        if connected and not self._connected:
+            self._schedule_object_info_refresh()
+        self._connected = connected
+        return connected
     
-    async def _wait_for_completion(self, prompt_id: str, progress_callback: Optional[Callable] = None) -> Dict[str, Any]:
+    async def _wait_for_completion(self, prompt_id: str, progress_callback: Optional[Callable] = None,
+                                  expected_duration: Optional[float] = None) -> Dict[str, Any]:
         """
         等待生成完成
+
+        从任务离开 ComfyUI 的 queue_pending 开始计时，自适应超时和返回的
+        execution_time 都只覆盖实际执行阶段，不包含在 ComfyUI 队列中的等待。
         """
-        max_wait_time = 300  # 最大等待时间 5 分钟
+        if not expected_duration:
+            expected_duration = self.predict_duration()
+        execution_timeout = self.get_timeout(expected_duration)  # 按预测耗时自适应
         check_interval = 2   # 检查间隔 2 秒
-        elapsed_time = 0
+        submitted_at = time.monotonic()
+        last_pending_at = submitted_at
+        execution_started_at = None
         
-        while elapsed_time < max_wait_time:
+        while True:
+            now = time.monotonic()
+            if execution_started_at is None:
+                # 排队等待的上限与最大超时相同
+                if now - submitted_at > self.max_timeout:
+                    await self._cancel_prompt(prompt_id)
+                    raise GenerationError("等待 ComfyUI 队列超时")
+            elif now - execution_started_at > execution_timeout:
+                await self._cancel_prompt(prompt_id, running=True)
+                raise GenerationTimeoutError("生成超时", now - execution_started_at)
+            
             try:
                 async with aiohttp.ClientSession() as session:
                     # 检查队列状态
                     async with session.get(f"{self.comfyui_url}/queue") as response:
                         if response.status == 200:
                             queue_data = await response.json()
+                            state = self._get_queue_state(prompt_id, queue_data)
+                            now = time.monotonic()
                             
-                            # 检查是否完成
-                            if not self._is_in_queue(prompt_id, queue_data):
-                                # 获取生成结果
-                                return await self._get_generation_result(prompt_id)
-                    
-                    # 更新进度
-                    if progress_callback:
-                        progress = 0.3 + (elapsed_time / max_wait_time) * 0.6
-                        progress_callback(min(progress, 0.9))
-                    
-                    await asyncio.sleep(check_interval)
-                    elapsed_time += check_interval
-                    
+                            if state == "pending":
+                                last_pending_at = now
+                            elif state == "running":
+                                if execution_started_at is None:
+                                    execution_started_at = now
+                            else:
+                                # 两次检查之间完成时，以最后一次看到排队的时间作为开始
+                                result = await self._get_generation_result(prompt_id)
+                                result["execution_time"] = now - (execution_started_at or last_pending_at)
+                                return result
+            except GenerationError:
+                raise
             except Exception as e:
                 print(f"检查生成状态时出错: {str(e)}")
-                break
-        
-        raise Exception("生成超时")
+                raise GenerationError(f"检查生成状态失败: {str(e)}")
+            
+            # 按预测耗时更新进度，排队期间保持不变
+            if progress_callback and execution_started_at is not None:
+                progress = 0.3 + ((time.monotonic() - execution_started_at) / expected_duration) * 0.6
+                progress_callback(min(progress, 0.9))
+            
+            await asyncio.sleep(check_interval)
     
-    def _is_in_queue(self, prompt_id: str, queue_data: Dict) -> bool:
+    async def _cancel_prompt(self, prompt_id: str, running: bool = False):
         """
-        检查 prompt_id 是否还在队列中
+        放弃等待时从 ComfyUI 队列删除任务，正在执行的任务发送中断
         """
         try:
-            running = queue_data.get("queue_running", [])
-            pending = queue_data.get("queue_pending", [])
-            
-            for item in running + pending:
-                if len(item) > 1 and item[1] == prompt_id:
-                    return True
-            return False
+            async with aiohttp.ClientSession() as session:
+                async with session.post(
+                    f"{self.comfyui_url}/queue",
+                    json={"delete": [prompt_id]},
+                    timeout=5
+                ) as response:
+                    pass
+                if running:
+                    # 旧版 ComfyUI 忽略 prompt_id，中断当前正在执行的任务
+                    async with session.post(
+                        f"{self.comfyui_url}/interrupt",
+                        json={"prompt_id": prompt_id},
+                        timeout=5
+                    ) as response:
+                        pass
+        except Exception as e:
+            print(f"取消 ComfyUI 任务 {prompt_id} 失败: {str(e)}")
+    
+    def _get_queue_state(self, prompt_id: str, queue_data: Dict) -> Optional[str]:
+        """
+        获取 prompt_id 在 ComfyUI 队列中的状态: running、pending 或 None（已不在队列中）
+        """
+        try:
+            for state, key in (("running", "queue_running"), ("pending", "queue_pending")):
+                for item in queue_data.get(key, []):
+                    if len(item) > 1 and item[1] == prompt_id:
+                        return state
+            return None
         except:
-            return True
+            return "pending"
     
     async def _get_generation_result(self, prompt_id: str) -> Dict[str, Any]:
         """
@@ -336,7 +634,7 @@ class ComfyUIService:
                                         img_type = img_info.get("type", "output")
                                         
                                         # 使用后端代理 URL
-                                        backend_url = f"http://localhost:8000/api/v1/image/{filename}?subfolder={subfolder}&type={img_type}"
+                                        backend_url = self.build_image_url(filename, subfolder, img_type)
                                         
                                         images.append({
                                             "filename": filename,
@@ -371,6 +669,7 @@ class ComfyUIService:
         # 返回模拟结果
         return {
             "workflow_id": "simulated_" + str(random.randint(1000, 9999)),
+            "simulated": True,
             "images": [{
                 "filename": "simulated_image.png",
                 "subfolder": "simulated",
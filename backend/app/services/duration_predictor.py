@@ -0,0 +1,113 @@
+import time
+from typing import Dict, Optional
+
+
+class DurationPredictor:
+    """
+    任务耗时预测器
+
+    按后端在线拟合 duration ≈ a + b * (width * height * steps)，
+    使用指数衰减的加权最小二乘，只保存充分统计量，每次更新 O(1)。
+    """
+
+    # 1024x1024, 20 步约 30 秒，作为尚无观测数据时的先验
+    DEFAULT_SECONDS_PER_UNIT = 30.0 / (1024 * 1024 * 20)
+
+    def __init__(self, decay: float = 0.98, min_samples: int = 3,
+                 default_seconds_per_unit: float = DEFAULT_SECONDS_PER_UNIT):
+        self.decay = decay
+        self.min_samples = min_samples
+        self.default_seconds_per_unit = default_seconds_per_unit
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def job_cost(width: int, height: int, steps: int) -> float:
+        """
+        计算任务的工作量（像素数 × 步数）
+        """
+        return float(max(width or 0, 1) * max(height or 0, 1) * max(steps or 0, 1))
+
+    def observe(self, backend: str, width: int, height: int, steps: int, duration: float):
+        """
+        记录一次实际执行耗时
+        """
+        if duration is None or duration <= 0:
+            return
+
+        x = self.job_cost(width, height, steps)
+        stats = self._stats.setdefault(backend, {
+            "n": 0, "w": 0.0, "x": 0.0, "y": 0.0, "xx": 0.0, "xy": 0.0, "updated_at": 0.0
+        })
+
+        # 旧观测按 decay 衰减，使模型跟随后端负载和硬件变化
+        for key in ("w", "x", "y", "xx", "xy"):
+            stats[key] *= self.decay
+
+        stats["n"] += 1
+        stats["w"] += 1.0
+        stats["x"] += x
+        stats["y"] += duration
+        stats["xx"] += x * x
+        stats["xy"] += x * duration
+        stats["updated_at"] = time.time()
+
+    def sample_count(self, backend: str) -> int:
+        """
+        获取后端已记录的观测次数
+        """
+        stats = self._stats.get(backend)
+        return stats["n"] if stats else 0
+
+    def _coefficients(self, backend: str) -> Optional[tuple]:
+        """
+        求解截距和斜率，数据不足时返回 None
+        """
+        stats = self._stats.get(backend)
+        if not stats or stats["w"] <= 0:
+            return None
+
+        w = stats["w"]
+        mean_x = stats["x"] / w
+        mean_y = stats["y"] / w
+        var_x = stats["xx"] / w - mean_x * mean_x
+
+        # 样本太少或工作量没有差异时，退化为按比例估计
+        if stats["n"] < self.min_samples or var_x <= (mean_x * 1e-6) ** 2:
+            if mean_x <= 0:
+                return None
+            return 0.0, mean_y / mean_x
+
+        slope = (stats["xy"] / w - mean_x * mean_y) / var_x
+        intercept = mean_y - slope * mean_x
+
+        # 斜率为负说明噪声过大，使用比例模型
+        if slope <= 0:
+            return 0.0, mean_y / mean_x
+        return max(intercept, 0.0), slope
+
+    def predict(self, backend: str, width: int, height: int, steps: int) -> float:
+        """
+        预测任务执行耗时（秒）
+        """
+        x = self.job_cost(width, height, steps)
+        coefficients = self._coefficients(backend)
+        if coefficients is None:
+            return x * self.default_seconds_per_unit
+
+        intercept, slope = coefficients
+        return intercept + slope * x
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        获取各后端的模型参数
+        """
+        result = {}
+        for backend, stats in self._stats.items():
+            coefficients = self._coefficients(backend) or (0.0, self.default_seconds_per_unit)
+            result[backend] = {
+                "samples": stats["n"],
+                "intercept_seconds": coefficients[0],
+                "seconds_per_megapixel_step": coefficients[1] * 1_000_000,
+                "updated_at": stats["updated_at"],
+            }
+        return result
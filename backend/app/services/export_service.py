@@ -0,0 +1,305 @@
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import aiofiles
+import aiohttp
+
+CHUNK_SIZE = 256 * 1024
+TAR_BLOCK_SIZE = 512
+TAR_RECORD_SIZE = 20 * TAR_BLOCK_SIZE
+
+
+class _StreamBuffer(io.RawIOBase):
+    """
+    只追加的输出缓冲，供 zipfile 以不可 seek 的流模式写入，写入后由生成器取走
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _ManifestSpool:
+    """
+    清单暂存文件，条目逐个写入临时文件，归档末尾再分块读出，内存占用不随条目数增长
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._count = 0
+        self._file.write(b"[")
+
+    def add(self, entry: Dict[str, Any]):
+        prefix = b",\n" if self._count else b"\n"
+        self._file.write(prefix + json.dumps(entry, ensure_ascii=False, indent=2).encode("utf-8"))
+        self._count += 1
+
+    def finish(self) -> int:
+        """
+        结束写入并返回清单大小
+        """
+        self._file.write(b"\n]\n")
+        size = self._file.tell()
+        self._file.seek(0)
+        return size
+
+    def chunks(self) -> Iterator[bytes]:
+        while True:
+            chunk = self._file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._file.close()
+
+
+class ExportService:
+    """
+    批量导出服务，将多张图像以 zip/tar 归档的形式流式输出
+
+    图像按块读取并立即写出，PNG 以存储（不压缩）方式打包，内存占用与归档大小无关。
+    """
+
+    def __init__(self, comfyui_service, image_service):
+        self.comfyui_service = comfyui_service
+        self.image_service = image_service
+
+    def _find_local_file(self, image: Dict[str, Any]) -> Optional[str]:
+        """
+        优先从 ComfyUI 本地目录或本服务的图像缓存目录查找文件
+        """
+        filename = image.get("filename")
+        if not filename:
+            return None
+
+        local_path = self.comfyui_service.resolve_local_path(
+            filename, image.get("subfolder", ""), image.get("type", "output")
+        )
+        if local_path:
+            return local_path
+
+        cached_path = os.path.join(self.image_service.output_dir, os.path.basename(filename))
+        return cached_path if os.path.isfile(cached_path) else None
+
+    async def _read_file(self, path: str) -> AsyncIterator[bytes]:
+        async with aiofiles.open(path, "rb") as f:
+            while True:
+                chunk = await f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def _read_remote(self, response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            yield chunk
+
+    async def _with_source(self, image: Dict[str, Any], needs_size: bool, write_entry):
+        """
+        打开图像数据源并交给 write_entry(size, chunks) 写出
+
+        本地文件直接读取；否则通过 ComfyUI /view 拉取，需要确定大小但响应
+        未给出长度时先落盘到临时文件。
+        """
+        local_path = self._find_local_file(image)
+        if local_path:
+            async for data in write_entry(os.path.getsize(local_path), self._read_file(local_path)):
+                yield data
+            return
+
+        params = {
+            "filename": image.get("filename", ""),
+            "subfolder": image.get("subfolder", ""),
+            "type": image.get("type", "output"),
+        }
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{self.comfyui_service.comfyui_url}/view", params=params) as response:
+                if response.status != 200:
+                    print(f"导出时获取图像失败: {params['filename']} HTTP {response.status}")
+                    return
+
+                if response.content_length is not None or not needs_size:
+                    async for data in write_entry(response.content_length, self._read_remote(response)):
+                        yield data
+                    return
+
+                with tempfile.TemporaryFile() as spool:
+                    async for chunk in self._read_remote(response):
+                        spool.write(chunk)
+                    size = spool.tell()
+                    spool.seek(0)
+
+                    async def read_spool():
+                        while True:
+                            chunk = spool.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            yield chunk
+
+                    async for data in write_entry(size, read_spool()):
+                        yield data
+
+    @staticmethod
+    async def _iter_entries(records: AsyncIterable[Dict[str, Any]]):
+        """
+        展开记录中的图像，生成 (归档内文件名, 图像信息, 所属记录)
+        """
+        index = 0
+        async for record in records:
+            for image in record.get("images", []):
+                # 模拟生成的占位图没有实际文件
+                if not image.get("filename") or image.get("subfolder") == "simulated":
+                    continue
+                index += 1
+                name = f"{index:05d}_{os.path.basename(image['filename'])}"
+                yield name, image, record
+
+    @staticmethod
+    def _manifest_entry(name: str, image: Dict[str, Any], record: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "file": name,
+            "task_id": record.get("task_id"),
+            "prompt": record.get("prompt"),
+            "seed": record.get("seed"),
+            "params": record.get("params"),
+            "source": {
+                "filename": image.get("filename"),
+                "subfolder": image.get("subfolder", ""),
+                "type": image.get("type", "output"),
+            },
+        }
+
+    async def stream_zip(self, records: AsyncIterable[Dict[str, Any]], include_manifest: bool = True) -> AsyncIterator[bytes]:
+        """
+        流式生成 zip 归档
+        """
+        buffer = _StreamBuffer()
+        archive = zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        manifest = _ManifestSpool() if include_manifest else None
+        date_time = datetime.now().timetuple()[:6]
+
+        async for name, image, record in self._iter_entries(records):
+            def write_entry(size: Optional[int], chunks: AsyncIterator[bytes], name=name):
+                async def writer():
+                    info = zipfile.ZipInfo(name, date_time=date_time)
+                    info.compress_type = zipfile.ZIP_STORED
+                    if size is not None:
+                        info.file_size = size
+                    with archive.open(info, "w", force_zip64=size is None) as dest:
+                        async for chunk in chunks:
+                            dest.write(chunk)
+                            yield buffer.drain()
+                    yield buffer.drain()
+                return writer()
+
+            written = False
+            async for data in self._with_source(image, False, write_entry):
+                written = True
+                if data:
+                    yield data
+            if written and manifest is not None:
+                manifest.add(self._manifest_entry(name, image, record))
+
+        if manifest is not None:
+            try:
+                info = zipfile.ZipInfo("manifest.json", date_time=date_time)
+                info.file_size = manifest.finish()
+                with archive.open(info, "w") as dest:
+                    for chunk in manifest.chunks():
+                        dest.write(chunk)
+                        yield buffer.drain()
+            finally:
+                manifest.close()
+        archive.close()
+        yield buffer.drain()
+
+    async def stream_tar(self, records: AsyncIterable[Dict[str, Any]], include_manifest: bool = True) -> AsyncIterator[bytes]:
+        """
+        流式生成 tar 归档
+        """
+        manifest = _ManifestSpool() if include_manifest else None
+        total = 0
+        mtime = int(time.time())  # 整数时间戳可用 ustar 头表示，不产生 PAX 扩展头
+
+        def tar_header(name: str, size: int) -> bytes:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = mtime
+            info.mode = 0o644
+            return info.tobuf(format=tarfile.PAX_FORMAT)
+
+        def tar_padding(size: int) -> bytes:
+            return b"\0" * (-size % TAR_BLOCK_SIZE)
+
+        async for name, image, record in self._iter_entries(records):
+            def write_entry(size: int, chunks: AsyncIterator[bytes], name=name):
+                async def writer():
+                    yield tar_header(name, size)
+                    written = 0
+                    async for chunk in chunks:
+                        written += len(chunk)
+                        yield chunk
+                    if written != size:
+                        raise Exception(f"导出图像大小不一致: {name}")
+                    yield tar_padding(size)
+                return writer()
+
+            written = False
+            async for data in self._with_source(image, True, write_entry):
+                written = True
+                total += len(data)
+                yield data
+            if written and manifest is not None:
+                manifest.add(self._manifest_entry(name, image, record))
+
+        if manifest is not None:
+            try:
+                size = manifest.finish()
+                header = tar_header("manifest.json", size)
+                total += len(header)
+                yield header
+                for chunk in manifest.chunks():
+                    total += len(chunk)
+                    yield chunk
+                padding = tar_padding(size)
+                total += len(padding)
+                yield padding
+            finally:
+                manifest.close()
+
+        # 结尾两个空块，并补齐到完整记录大小
+        end = b"\0" * (2 * TAR_BLOCK_SIZE)
+        total += len(end)
+        yield end + b"\0" * (-total % TAR_RECORD_SIZE)
+
+    def stream_archive(self, records: AsyncIterable[Dict[str, Any]], archive_format: str = "zip",
+                       include_manifest: bool = True) -> Tuple[AsyncIterator[bytes], str]:
+        """
+        返回归档数据流和对应的 MIME 类型
+        """
+        if archive_format == "tar":
+            return self.stream_tar(records, include_manifest), "application/x-tar"
+        return self.stream_zip(records, include_manifest), "application/zip"
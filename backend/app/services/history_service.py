@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class HistoryService:
+    """
+    生成历史服务，使用 SQLite + FTS5 持久化生成记录并支持提示词全文检索
+
+    除 record 外的查询方法均为同步阻塞调用，在事件循环中使用时需放到线程池执行。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv(
+            "FLUX_HISTORY_DB",
+            os.path.join(os.getenv("FLUX_OUTPUT_DIR", "/tmp/flux_images"), "history.db")
+        )
+        self._lock = threading.Lock()
+        self._conn = None
+        self.init_db()
+
+    def init_db(self):
+        """
+        初始化数据库和索引
+        """
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+
+                CREATE TABLE IF NOT EXISTS generations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL UNIQUE,
+                    prompt TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    params_hash TEXT NOT NULL,
+                    seed INTEGER,
+                    width INTEGER,
+                    height INTEGER,
+                    steps INTEGER,
+                    images TEXT NOT NULL,
+                    workflow_id TEXT,
+                    created_at REAL NOT NULL,
+                    completed_at REAL NOT NULL,
+                    execution_time REAL
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_generations_params_hash
+                    ON generations(params_hash);
+
+                CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+                    prompt, content='generations', content_rowid='id'
+                );
+
+                CREATE TRIGGER IF NOT EXISTS generations_ai AFTER INSERT ON generations BEGIN
+                    INSERT INTO generations_fts(rowid, prompt) VALUES (new.id, new.prompt);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS generations_ad AFTER DELETE ON generations BEGIN
+                    INSERT INTO generations_fts(generations_fts, rowid, prompt)
+                        VALUES ('delete', old.id, old.prompt);
+                END;
+            """)
+            print(f"生成历史数据库: {self.db_path}")
+        except Exception as e:
+            print(f"初始化生成历史数据库失败: {str(e)}")
+            self._conn = None
+
+    @staticmethod
+    def params_hash(params: Dict[str, Any]) -> str:
+        """
+        计算生成参数的哈希，用于结果缓存查找
+        """
+        canonical = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _row_to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "task_id": row["task_id"],
+            "prompt": row["prompt"],
+            "params": json.loads(row["params"]),
+            "seed": row["seed"],
+            "width": row["width"],
+            "height": row["height"],
+            "steps": row["steps"],
+            "images": json.loads(row["images"]),
+            "workflow_id": row["workflow_id"],
+            "created_at": row["created_at"],
+            "completed_at": row["completed_at"],
+            "execution_time": row["execution_time"],
+        }
+
+    def _record(self, task_id: str, params: Dict[str, Any], result: Dict[str, Any],
+                created_at: float) -> Optional[int]:
+        if self._conn is None:
+            return None
+
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                INSERT OR IGNORE INTO generations (
+                    task_id, prompt, params, params_hash, seed, width, height, steps,
+                    images, workflow_id, created_at, completed_at, execution_time
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    task_id,
+                    params.get("prompt", ""),
+                    json.dumps(params, ensure_ascii=False),
+                    self.params_hash(params),
+                    params.get("seed"),
+                    params.get("width"),
+                    params.get("height"),
+                    params.get("steps"),
+                    json.dumps(result.get("images", []), ensure_ascii=False),
+                    result.get("workflow_id"),
+                    created_at,
+                    time.time(),
+                    result.get("execution_time"),
+                )
+            )
+            return cursor.lastrowid
+
+    async def record(self, task_id: str, params: Dict[str, Any], result: Dict[str, Any],
+                     created_at: float) -> Optional[int]:
+        """
+        记录一次完成的生成，写入在线程池中执行，不阻塞事件循环
+        """
+        try:
+            return await asyncio.to_thread(self._record, task_id, params, result, created_at)
+        except Exception as e:
+            print(f"记录生成历史失败: {str(e)}")
+            return None
+
+    def _query(self, sql: str, args: tuple) -> List[Dict[str, Any]]:
+        if self._conn is None:
+            return []
+        with self._lock:
+            return [self._row_to_dict(row) for row in self._conn.execute(sql, args)]
+
+    def list_history(self, limit: int = 50, cursor: Optional[int] = None) -> Dict[str, Any]:
+        """
+        按时间倒序分页列出历史记录，cursor 为上一页最后一条记录的 id
+        """
+        limit = max(1, min(limit, 200))
+        if cursor is None:
+            items = self._query(
+                "SELECT * FROM generations ORDER BY id DESC LIMIT ?", (limit,)
+            )
+        else:
+            items = self._query(
+                "SELECT * FROM generations WHERE id < ? ORDER BY id DESC LIMIT ?", (cursor, limit)
+            )
+        return self._page(items, limit)
+
+    @staticmethod
+    def _fts_query(query: str) -> str:
+        """
+        将用户输入转换为安全的 FTS5 查询，最后一个词按前缀匹配
+        """
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        if terms:
+            terms[-1] += "*"
+        return " ".join(terms)
+
+    def search_history(self, query: str, limit: int = 50, cursor: Optional[int] = None) -> Dict[str, Any]:
+        """
+        按提示词全文检索历史记录，结果按时间倒序并使用 id 游标分页
+        """
+        limit = max(1, min(limit, 200))
+        match = self._fts_query(query)
+        if not match:
+            return self.list_history(limit, cursor)
+
+        sql = """
+            SELECT g.* FROM generations_fts f
+            JOIN generations g ON g.id = f.rowid
+            WHERE generations_fts MATCH ? {cursor_clause}
+            ORDER BY f.rowid DESC LIMIT ?
+        """
+        if cursor is None:
+            items = self._query(sql.format(cursor_clause=""), (match, limit))
+        else:
+            items = self._query(sql.format(cursor_clause="AND f.rowid < ?"), (match, cursor, limit))
+        return self._page(items, limit)
+
+    @staticmethod
+    def _page(items: List[Dict[str, Any]], limit: int) -> Dict[str, Any]:
+        return {
+            "items": items,
+            "next_cursor": items[-1]["id"] if len(items) == limit else None,
+        }
+
+    def get_by_task_id(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        根据任务 ID 获取历史记录
+        """
+        items = self._query("SELECT * FROM generations WHERE task_id = ?", (task_id,))
+        return items[0] if items else None
+
+    def find_cached(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        查找参数（含种子）完全相同的最近一次生成结果
+        """
+        items = self._query(
+            "SELECT * FROM generations WHERE params_hash = ? ORDER BY id DESC LIMIT 1",
+            (self.params_hash(params),)
+        )
+        return items[0] if items else None
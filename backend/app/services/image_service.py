@@ -1,19 +1,29 @@
 import os
+import mmap
+import struct
 import base64
 import aiofiles
 from PIL import Image
 import io
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable
 import aiohttp
 from datetime import datetime
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG IHDR 颜色类型到 PIL 模式的映射
+PNG_COLOR_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+
 class ImageService:
     """
     图像服务类，负责图像处理和存储
     """
     
-    def __init__(self, output_dir: str = "/tmp/flux_images"):
+    def __init__(self, output_dir: str = "/tmp/flux_images",
+                 local_resolver: Optional[Callable[[str, str, str], Optional[str]]] = None):
         self.output_dir = output_dir
+        # 将 ComfyUI 的 (filename, subfolder, type) 解析为本地路径，不可用时返回 None
+        self.local_resolver = local_resolver
         self.ensure_output_dir()
     
     def ensure_output_dir(self):
@@ -97,11 +107,36 @@ class ImageService:
             print(f"调整图像大小时出错: {str(e)}")
             return None
     
+    def _read_png_info(self, image_path: str) -> Optional[Dict[str, Any]]:
+        """
+        通过 mmap 直接读取 PNG 的 IHDR 块，不解码图像
+        """
+        with open(image_path, 'rb') as f:
+            size_bytes = os.fstat(f.fileno()).st_size
+            if size_bytes < 26:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:8] != PNG_SIGNATURE or mm[12:16] != b"IHDR":
+                    return None
+                width, height, _, color_type = struct.unpack(">IIBB", mm[16:26])
+        
+        return {
+            "width": width,
+            "height": height,
+            "format": "PNG",
+            "mode": PNG_COLOR_MODES.get(color_type, "unknown"),
+            "size_bytes": size_bytes
+        }
+    
     def get_image_info(self, image_path: str) -> Optional[Dict[str, Any]]:
         """
         获取图像信息
         """
         try:
+            info = self._read_png_info(image_path)
+            if info:
+                return info
+            
             with Image.open(image_path) as img:
                 return {
                     "width": img.width,
@@ -122,6 +157,18 @@ class ImageService:
         
         for img_info in images_info:
             try:
+                # ComfyUI 输出在本机时直接使用原文件，不经 HTTP 下载
+                local_path = None
+                if self.local_resolver and img_info.get('filename'):
+                    local_path = self.local_resolver(
+                        img_info['filename'],
+                        img_info.get('subfolder', ''),
+                        img_info.get('type', 'output')
+                    )
+                if local_path:
+                    img_info = {**img_info, 'local_path': local_path}
+                    img_info.pop('url', None)
+                
                 # 如果是 URL，下载图像
                 if 'url' in img_info:
                     local_path = await self.download_image(
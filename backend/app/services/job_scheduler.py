@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class JobScheduler:
+    """
+    图像生成任务调度器
+
+    控制同时提交到 ComfyUI 的任务数量，并按调度模式决定等待任务的执行顺序：
+    - fifo: 按到达顺序
+    - sjf:  预测耗时最短的任务优先，降低混合负载下的平均延迟
+    - wfq:  按来源加权公平排队，避免单个客户端的大任务占满后端
+
+    priority 较高的任务（如草稿预览）在任何模式下都先于普通任务执行。
+    """
+
+    MODES = ("fifo", "sjf", "wfq")
+
+    def __init__(self, mode: str = "fifo", max_concurrent: int = 1):
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的调度模式: {mode}")
+        self.mode = mode
+        self.max_concurrent = max(1, max_concurrent)
+        self._queue: List[tuple] = []
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._counter = itertools.count()
+        self._virtual_time = 0.0
+        self._flow_finish: Dict[str, float] = {}
+
+    def _make_key(self, estimate: float, flow: str, weight: float, seq: int) -> tuple:
+        """
+        根据调度模式计算排序键，返回 (排序键, 虚拟开始时间, 虚拟结束时间)
+        """
+        if self.mode == "sjf":
+            return (estimate, seq), None, None
+        if self.mode == "wfq":
+            start = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+            finish = start + estimate / max(weight, 1e-6)
+            self._flow_finish[flow] = finish
+            return (finish, seq), start, finish
+        return (seq,), None, None
+
+    def _rollback_flow(self, entry: Dict[str, Any]):
+        """
+        排队中的 wfq 任务取消后，从所属流的结束标签中扣除其虚拟时长
+        """
+        flow = entry["flow"]
+        if entry["virtual_finish"] is None or flow not in self._flow_finish:
+            return
+        if self._flow_finish[flow] == entry["virtual_finish"]:
+            # 是该流最后入队的任务，直接恢复入队前的标签
+            self._flow_finish[flow] = entry["prev_finish"]
+        else:
+            self._flow_finish[flow] -= entry["virtual_finish"] - entry["virtual_start"]
+        if self._flow_finish[flow] <= self._virtual_time:
+            del self._flow_finish[flow]
+
+    async def run(self, task_id: str, job: Callable[[], Awaitable[Any]], estimate: float,
+                  flow: str = "default", weight: float = 1.0, priority: int = 0) -> Any:
+        """
+        排队等待执行槽位，然后执行任务
+        """
+        loop = asyncio.get_running_loop()
+        seq = next(self._counter)
+        prev_finish = self._flow_finish.get(flow, 0.0)
+        key, virtual_start, virtual_finish = self._make_key(estimate, flow, weight, seq)
+        key = (-priority,) + key
+        entry = {
+            "task_id": task_id,
+            "estimate": estimate,
+            "flow": flow,
+            "prev_finish": prev_finish,
+            "virtual_start": virtual_start,
+            "virtual_finish": virtual_finish,
+            "future": loop.create_future(),
+            "cancelled": False,
+        }
+        heapq.heappush(self._queue, (key, entry))
+        self._pending[task_id] = entry
+        self._dispatch()
+
+        try:
+            await entry["future"]
+        except asyncio.CancelledError:
+            # 仍在排队时被取消，惰性删除堆中的条目
+            entry["cancelled"] = True
+            self._pending.pop(task_id, None)
+            if task_id in self._running:
+                self._release(task_id)
+            else:
+                self._rollback_flow(entry)
+            raise
+
+        try:
+            return await job()
+        finally:
+            self._release(task_id)
+
+    def _release(self, task_id: str):
+        """
+        释放执行槽位并调度下一个任务
+        """
+        self._running.pop(task_id, None)
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        在有空闲槽位时唤醒排在最前面的任务
+        """
+        while self._queue and len(self._running) < self.max_concurrent:
+            _, entry = heapq.heappop(self._queue)
+            task_id = entry["task_id"]
+            if entry["cancelled"] or entry["future"].done():
+                continue
+
+            self._pending.pop(task_id, None)
+            if entry["virtual_start"] is not None and entry["virtual_start"] > self._virtual_time:
+                self._virtual_time = entry["virtual_start"]
+                # 结束标签不晚于虚拟时间的流与新流等价，不再保留
+                self._flow_finish = {
+                    flow: finish for flow, finish in self._flow_finish.items() if finish > self._virtual_time
+                }
+            self._running[task_id] = {
+                "estimate": entry["estimate"],
+                "started_at": time.monotonic(),
+            }
+            entry["future"].set_result(None)
+
+    def _ordered_pending(self) -> List[Dict[str, Any]]:
+        """
+        按调度顺序返回等待中的任务
+        """
+        return [entry for _, entry in sorted(self._queue, key=lambda item: item[0]) if not entry["cancelled"]]
+
+    def get_queue_position(self, task_id: str) -> Optional[int]:
+        """
+        获取任务在等待队列中的位置（从 0 开始），不在队列中返回 None
+        """
+        if task_id not in self._pending:
+            return None
+        for position, entry in enumerate(self._ordered_pending()):
+            if entry["task_id"] == task_id:
+                return position
+        return None
+
+    def estimate_remaining(self, task_id: str) -> Optional[float]:
+        """
+        估算任务距离完成的剩余时间（秒）
+        """
+        now = time.monotonic()
+        running_left = [
+            max(info["estimate"] - (now - info["started_at"]), 0.0)
+            for info in self._running.values()
+        ]
+
+        if task_id in self._running:
+            info = self._running[task_id]
+            return max(info["estimate"] - (now - info["started_at"]), 0.0)
+
+        if task_id not in self._pending:
+            return None
+
+        # 模拟各执行槽位依次空出的时间
+        slots = sorted(running_left + [0.0] * (self.max_concurrent - len(running_left)))
+        for entry in self._ordered_pending():
+            start = heapq.heappop(slots)
+            if entry["task_id"] == task_id:
+                return start + entry["estimate"]
+            heapq.heappush(slots, start + entry["estimate"])
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取调度器状态
+        """
+        return {
+            "mode": self.mode,
+            "max_concurrent": self.max_concurrent,
+            "running": len(self._running),
+            "pending": len(self._pending),
+        }
@@ -0,0 +1,255 @@
+import asyncio
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监控
+
+    事件循环内的心跳协程定期记录时间戳，独立的看门狗线程检查心跳是否超时；
+    超过阈值时抓取事件循环线程当前的调用栈，定位阻塞事件循环的同步调用。
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, max_stalls: int = 100):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque(maxlen=max_stalls)
+        self._loop_thread_id = None
+        self._last_tick = 0.0
+        self._heartbeat_task = None
+        self._watchdog = None
+        self._stop_event = None
+
+    @property
+    def running(self) -> bool:
+        return self._heartbeat_task is not None and not self._heartbeat_task.done()
+
+    def start(self):
+        """
+        在当前事件循环中启动监控
+        """
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop_event = threading.Event()
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(
+            target=self._watch, args=(self._stop_event,), name="loop-lag-watchdog", daemon=True
+        )
+        self._watchdog.start()
+        print(f"事件循环延迟监控已启动，阈值 {self.threshold * 1000:.0f} ms")
+
+    def stop(self):
+        """
+        停止监控
+        """
+        if self._stop_event:
+            self._stop_event.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _heartbeat(self):
+        while True:
+            self._last_tick = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self, stop_event: threading.Event):
+        reported_tick = None
+        while not stop_event.wait(self.interval):
+            last_tick = self._last_tick
+            lag = time.monotonic() - last_tick - self.interval
+            if lag < self.threshold:
+                continue
+            # 同一次卡顿只记录一次调用栈，持续期间更新卡顿时长
+            if last_tick == reported_tick:
+                self.stalls[-1]["lag_ms"] = round(lag * 1000, 1)
+                continue
+
+            reported_tick = last_tick
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = traceback.format_stack(frame) if frame else []
+            self.stalls.append({
+                "detected_at": datetime.now().isoformat(),
+                "lag_ms": round(lag * 1000, 1),
+                "stack": stack,
+            })
+            location = stack[-1].strip().splitlines()[0] if stack else "unknown"
+            print(f"事件循环阻塞 {lag * 1000:.0f} ms: {location}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取监控状态和最近的卡顿记录
+        """
+        return {
+            "running": self.running,
+            "threshold_ms": self.threshold * 1000,
+            "stalls": list(self.stalls),
+        }
+
+
+class RequestProfiler:
+    """
+    按请求采样的 cProfile 分析器
+
+    请求显式要求或命中采样率时才启用，同一时刻只分析一个请求；
+    分析结果保存为 pstats 文件供下载。
+
+    注意：cProfile 记录的是整个事件循环线程，请求 await 期间运行的其他协程
+    （其他请求、后台生成任务、调度器等）也会出现在同一份结果中。
+    """
+
+    def __init__(self, profile_dir: str = "/tmp/flux_profiles", sample_rate: float = 0.0,
+                 max_profiles: int = 50):
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        self._profiles = deque()
+
+    def should_profile(self, requested: bool) -> bool:
+        """
+        判断当前请求是否需要分析
+        """
+        if requested:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """
+        开始分析，已有请求在分析时返回 None
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish(self, profiler: cProfile.Profile, profile_id: str, method: str, path: str,
+               duration: float) -> Optional[str]:
+        """
+        结束分析并保存结果，返回分析 ID
+        """
+        try:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{profile_id}.prof"))
+
+            self._profiles.append({
+                "profile_id": profile_id,
+                "method": method,
+                "path": path,
+                "duration_ms": round(duration * 1000, 1),
+                "created_at": datetime.now().isoformat(),
+            })
+            while len(self._profiles) > self.max_profiles:
+                expired = self._profiles.popleft()
+                expired_path = self.get_profile_path(expired["profile_id"])
+                if expired_path:
+                    os.remove(expired_path)
+            return profile_id
+        except Exception as e:
+            print(f"保存性能分析结果失败: {str(e)}")
+            return None
+        finally:
+            self._lock.release()
+
+    def get_profile_path(self, profile_id: str) -> Optional[str]:
+        """
+        获取分析文件路径，ID 不合法或文件不存在时返回 None
+        """
+        if not profile_id.isalnum():
+            return None
+        path = os.path.join(self.profile_dir, f"{profile_id}.prof")
+        return path if os.path.isfile(path) else None
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """
+        列出已保存的分析结果
+        """
+        return list(reversed(self._profiles))
+
+
+class RequestProfilingMiddleware:
+    """
+    按请求性能分析的 ASGI 中间件
+
+    管理员通过 X-Profile 头或 profile=1 查询参数显式开启，或按采样率随机开启。
+    未开启采样且请求不带管理员令牌时直接交给应用处理；分析持续到最后一个
+    http.response.body 消息发出，包含流式响应体的生成过程。
+    """
+
+    def __init__(self, app, profiler: RequestProfiler, is_admin: Callable[[Optional[str]], bool]):
+        self.app = app
+        self.profiler = profiler
+        self.is_admin = is_admin
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        admin_token = None
+        profile_header = None
+        for name, value in scope["headers"]:
+            if name == b"x-admin-token":
+                admin_token = value.decode("latin-1")
+            elif name == b"x-profile":
+                profile_header = value
+
+        if admin_token is None and self.profiler.sample_rate <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        requested = False
+        if admin_token is not None:
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            requested = (profile_header == b"1" or query.get("profile") == ["1"]) and self.is_admin(admin_token)
+
+        if not self.profiler.should_profile(requested):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = self.profiler.start()
+        if profiler is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        start_time = time.perf_counter()
+        finished = False
+
+        def finish():
+            nonlocal finished
+            if not finished:
+                finished = True
+                self.profiler.finish(
+                    profiler, profile_id, scope.get("method", ""), scope.get("path", ""),
+                    time.perf_counter() - start_time
+                )
+
+        async def send_wrapper(message):
+            # 只向显式请求分析的管理员返回分析 ID，采样到的普通请求不暴露
+            if requested and message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
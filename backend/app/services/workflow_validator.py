@@ -0,0 +1,124 @@
+import time
+from typing import Any, Dict, List, Optional
+
+
+class WorkflowValidationError(Exception):
+    """
+    工作流校验失败
+    """
+
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__("工作流校验失败: " + "; ".join(errors))
+
+
+class ObjectInfoSchema:
+    """
+    ComfyUI /object_info 节点定义的预编译形式
+
+    加载时将每个节点的输入定义编译为 (kind, 约束) 元组，校验时只做字典查找和比较。
+    """
+
+    def __init__(self, object_info: Dict[str, Any]):
+        self.fetched_at = time.time()
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        for class_type, info in object_info.items():
+            inputs = info.get("input", {}) if isinstance(info, dict) else {}
+            required = inputs.get("required", {}) or {}
+            optional = inputs.get("optional", {}) or {}
+            compiled = {}
+            for name, spec in list(required.items()) + list(optional.items()):
+                compiled[name] = self._compile_input(spec)
+            self.nodes[class_type] = {
+                "inputs": compiled,
+                "required": frozenset(required),
+            }
+
+    @staticmethod
+    def _compile_input(spec: Any) -> tuple:
+        """
+        编译单个输入定义
+        """
+        if not isinstance(spec, (list, tuple)) or not spec:
+            return ("any", None)
+
+        input_type = spec[0]
+        options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+
+        # 旧版以列表表示下拉选项，新版使用 COMBO 类型
+        if isinstance(input_type, list):
+            return ("choice", frozenset(input_type))
+        if input_type == "COMBO":
+            return ("choice", frozenset(options.get("options", [])))
+        if input_type in ("INT", "FLOAT"):
+            return (input_type.lower(), (options.get("min"), options.get("max")))
+        if input_type in ("STRING", "BOOLEAN"):
+            return (input_type.lower(), None)
+        return ("link", input_type)
+
+    def get_choices(self, class_type: str, input_name: str) -> Optional[frozenset]:
+        """
+        获取下拉类型输入的可选值
+        """
+        spec = self.nodes.get(class_type, {}).get("inputs", {}).get(input_name)
+        if spec and spec[0] == "choice":
+            return spec[1]
+        return None
+
+    def validate(self, workflow: Dict[str, Any]) -> List[str]:
+        """
+        校验 API 格式的工作流，返回错误列表（为空表示通过）
+        """
+        errors = []
+        for node_id, node in workflow.items():
+            class_type = node.get("class_type")
+            definition = self.nodes.get(class_type)
+            if definition is None:
+                errors.append(f"节点 {node_id}: 后端不支持节点类型 {class_type}")
+                continue
+
+            values = node.get("inputs", {})
+            for name in definition["required"]:
+                if name not in values:
+                    errors.append(f"节点 {node_id} ({class_type}): 缺少输入 {name}")
+
+            for name, value in values.items():
+                spec = definition["inputs"].get(name)
+                if spec is None:
+                    continue
+                error = self._validate_value(workflow, spec, value)
+                if error:
+                    errors.append(f"节点 {node_id} ({class_type}).{name}: {error}")
+        return errors
+
+    @staticmethod
+    def _validate_value(workflow: Dict[str, Any], spec: tuple, value: Any) -> Optional[str]:
+        """
+        校验单个输入值
+        """
+        # [节点ID, 输出序号] 表示连接到其他节点的输出
+        if isinstance(value, list) and len(value) == 2 and isinstance(value[1], int):
+            if str(value[0]) not in workflow:
+                return f"连接的节点 {value[0]} 不存在"
+            return None
+
+        kind, constraint = spec
+        if kind == "choice":
+            if value not in constraint:
+                return f"无效值 {value!r}，可选值: {', '.join(sorted(map(str, constraint)))}"
+        elif kind in ("int", "float"):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return f"应为数值，实际为 {value!r}"
+            if kind == "int" and not float(value).is_integer():
+                return f"应为整数，实际为 {value!r}"
+            low, high = constraint
+            if low is not None and value < low:
+                return f"{value} 小于最小值 {low}"
+            if high is not None and value > high:
+                return f"{value} 大于最大值 {high}"
+        elif kind == "string":
+            if not isinstance(value, str):
+                return f"应为字符串，实际为 {value!r}"
+        elif kind == "link":
+            return f"应连接到 {constraint} 类型的节点输出"
+        return None
@@ -61,6 +61,11 @@ export function getConfig(): ApiConfig {
 export const API_ENDPOINTS = {
   generate: '/api/v1/generate',
   task: (taskId: string) => `/api/v1/task/${taskId}`,
+  promoteDraft: (taskId: string) => `/api/v1/task/${taskId}/promote`,
+  skipDraft: (taskId: string) => `/api/v1/task/${taskId}/skip`,
+  history: '/api/v1/history',
+  historySearch: '/api/v1/history/search',
+  export: '/api/v1/export',
   health: '/api/v1/health'
 } as const;
 
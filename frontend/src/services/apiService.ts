@@ -8,6 +8,8 @@ export interface ImageGenerationRequest {
   steps: number;
   cfg: number;
   seed: number;
+  draft?: boolean;
+  auto_full?: boolean;
 }
 
 // 图像生成响应
@@ -19,7 +21,7 @@ export interface ImageGenerationResponse {
 
 // 任务状态响应
 export interface TaskStatusResponse {
-  status: 'pending' | 'processing' | 'completed' | 'failed';
+  status: 'pending' | 'processing' | 'draft_completed' | 'completed' | 'failed';
   progress?: number;
   result?: {
     images: Array<{
@@ -30,6 +32,38 @@ export interface TaskStatusResponse {
     }>;
   };
   error?: string;
+  eta_seconds?: number | null;
+  queue_position?: number | null;
+  phase?: 'draft' | 'full' | null;
+  draft_result?: TaskStatusResponse['result'] | null;
+}
+
+// 生成历史记录
+export interface HistoryItem {
+  id: number;
+  task_id: string;
+  prompt: string;
+  params: Record<string, unknown>;
+  seed: number | null;
+  width: number | null;
+  height: number | null;
+  steps: number | null;
+  images: Array<{
+    filename: string;
+    subfolder: string;
+    type: string;
+    url: string;
+  }>;
+  workflow_id: string | null;
+  created_at: number;
+  completed_at: number;
+  execution_time: number | null;
+}
+
+// 生成历史分页响应
+export interface HistoryPage {
+  items: HistoryItem[];
+  next_cursor: number | null;
 }
 
 // API 服务类
@@ -70,6 +104,22 @@ export class ApiService {
     return response.json();
   }
   
+  // 草稿完成后执行完整质量生成，skip 为 true 时以草稿作为最终结果
+  static async resolveDraft(taskId: string, skip = false): Promise<TaskStatusResponse> {
+    const url = buildApiUrl(skip ? API_ENDPOINTS.skipDraft(taskId) : API_ENDPOINTS.promoteDraft(taskId));
+    
+    const response = await fetchWithRetry(url, {
+      method: 'POST'
+    });
+    
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.message || `HTTP ${response.status}: ${response.statusText}`);
+    }
+    
+    return response.json();
+  }
+  
   // 轮询任务状态直到完成
   static async pollTaskStatus(
     taskId: string,
@@ -87,7 +137,7 @@ export class ApiService {
           }
           
           // 检查是否完成
-          if (status.status === 'completed' || status.status === 'failed') {
+          if (status.status === 'completed' || status.status === 'failed' || status.status === 'draft_completed') {
             resolve(status);
             return;
           }
@@ -104,6 +154,51 @@ export class ApiService {
     });
   }
   
+  // 分页获取生成历史，query 不为空时按提示词检索
+  static async getHistory(query?: string, cursor?: number | null, limit = 50): Promise<HistoryPage> {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (query) {
+      params.set('q', query);
+    }
+    if (cursor !== undefined && cursor !== null) {
+      params.set('cursor', String(cursor));
+    }
+    
+    const endpoint = query ? API_ENDPOINTS.historySearch : API_ENDPOINTS.history;
+    const response = await fetchWithRetry(`${buildApiUrl(endpoint)}?${params.toString()}`, {
+      method: 'GET'
+    });
+    
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.message || `HTTP ${response.status}: ${response.statusText}`);
+    }
+    
+    return response.json();
+  }
+  
+  // 批量导出图像为归档文件，由浏览器直接流式保存，不在内存中缓冲
+  static exportImages(
+    options: { taskIds?: string[]; query?: string; limit?: number; format?: 'zip' | 'tar'; manifest?: boolean } = {}
+  ): void {
+    const params = new URLSearchParams();
+    options.taskIds?.forEach(taskId => params.append('task_ids', taskId));
+    if (options.query) {
+      params.set('q', options.query);
+    }
+    if (options.limit !== undefined) {
+      params.set('limit', String(options.limit));
+    }
+    params.set('format', options.format || 'zip');
+    params.set('manifest', String(options.manifest ?? true));
+    
+    const a = document.createElement('a');
+    a.href = `${buildApiUrl(API_ENDPOINTS.export)}?${params.toString()}`;
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+  }
+  
   // 下载图像
   static async downloadImage(imageUrl: string, filename?: string): Promise<void> {
     const response = await fetchWithRetry(imageUrl);